@@ -0,0 +1,148 @@
+# Copyright (C) 2025 Shoal Software LLC. All rights reserved.
+#
+# This is commercial software and cannot be used without prior permission.
+# See the included LICENSE file for further specific terms and conditions.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from types import TracebackType
+from typing import Generic, TypeVar
+
+_T = TypeVar("_T")
+
+
+@dataclass
+class _QueuedGoalRun(Generic[_T]):
+    """A goal run waiting for (or being run by) a goal worker, and the
+    number of callers waiting on its result."""
+
+    run_goal: Callable[[], _T]
+    future: asyncio.Future[_T]
+    key: Hashable
+    waiters: int = 0
+
+
+class GoalRunner(Generic[_T]):
+    """Run blocking goal functions in threads using a fixed number of
+    workers.
+
+    Goal runs are queued and picked up by the workers in order. Each worker runs one goal at a
+    time, and so the number of workers bounds how many goals run concurrently. Running the goals in
+    threads keeps the event loop free to service other requests while goals are running.
+
+    Goal runs with the same key share a single goal run while it is still queued. Once a worker
+    has started a goal run, later calls queue a new goal run instead, since the inputs of the
+    running goal (e.g., files in the workspace) may have changed since it started.
+
+    The workers are started on entering the runner as an async context manager and are stopped on
+    exit. Goal runs which are still queued at that point are cancelled.
+    """
+
+    def __init__(self, *, max_concurrent_goals: int, queue_size: int) -> None:
+        if max_concurrent_goals < 1:
+            raise ValueError(f"max_concurrent_goals must be at least 1, got {max_concurrent_goals}")
+        self._max_concurrent_goals = max_concurrent_goals
+        self._queue: asyncio.Queue[_QueuedGoalRun[_T]] = asyncio.Queue(maxsize=queue_size)
+        self._workers: list[asyncio.Task[None]] = []
+        # Goal runs which no worker has picked up yet.
+        self._queued_goal_runs: dict[Hashable, _QueuedGoalRun[_T]] = {}
+
+    async def __aenter__(self) -> GoalRunner[_T]:
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self._max_concurrent_goals)
+        ]
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        while not self._queue.empty():
+            self._queue.get_nowait().future.cancel()
+            self._queue.task_done()
+
+    async def run(self, key: Hashable, run_goal: Callable[[], _T]) -> _T:
+        """Run a goal and return its result, sharing a queued goal run with
+        the same key if there is one.
+
+        The shared goal run is only cancelled once every caller waiting
+        on it has been cancelled.
+        """
+        queued_goal_run = self._queued_goal_run(key)
+        if queued_goal_run is None:
+            future: asyncio.Future[_T] = asyncio.get_running_loop().create_future()
+            new_goal_run = _QueuedGoalRun(run_goal, future, key)
+            await self._queue.put(new_goal_run)
+
+            # An identical call may have been queued while waiting for space in the queue. If so,
+            # share that goal run and cancel this one so the goal workers skip it.
+            queued_goal_run = self._queued_goal_run(key)
+            if queued_goal_run is None:
+                queued_goal_run = new_goal_run
+                self._queued_goal_runs[key] = new_goal_run
+                future.add_done_callback(lambda _: self._forget_queued_goal_run(new_goal_run))
+            else:
+                future.cancel()
+
+        # Shield the shared future so that one caller being cancelled does not cancel the goal run
+        # for the other callers.
+        queued_goal_run.waiters += 1
+        try:
+            return await asyncio.shield(queued_goal_run.future)
+        finally:
+            queued_goal_run.waiters -= 1
+            if queued_goal_run.waiters == 0 and not queued_goal_run.future.done():
+                queued_goal_run.future.cancel()
+
+    def _queued_goal_run(self, key: Hashable) -> _QueuedGoalRun[_T] | None:
+        queued_goal_run = self._queued_goal_runs.get(key)
+        if queued_goal_run is None or queued_goal_run.future.done():
+            return None
+        return queued_goal_run
+
+    def _forget_queued_goal_run(self, queued_goal_run: _QueuedGoalRun[_T]) -> None:
+        if self._queued_goal_runs.get(queued_goal_run.key) is queued_goal_run:
+            del self._queued_goal_runs[queued_goal_run.key]
+
+    async def _worker(self) -> None:
+        while True:
+            queued_goal_run = await self._queue.get()
+            # A goal run which has started can no longer be shared by later calls.
+            self._forget_queued_goal_run(queued_goal_run)
+            future = queued_goal_run.future
+            try:
+                if future.done():
+                    continue
+                try:
+                    result = await asyncio.to_thread(queued_goal_run.run_goal)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                # The worker may have been cancelled while the goal was running. The thread running
+                # the goal cannot be interrupted, but its callers must not wait forever on a result
+                # which will never be delivered.
+                if not future.done():
+                    future.cancel()
+                self._queue.task_done()
@@ -0,0 +1,230 @@
+# Copyright (C) 2025 Shoal Software LLC. All rights reserved.
+#
+# This is commercial software and cannot be used without prior permission.
+# See the included LICENSE file for further specific terms and conditions.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import annotations
+
+import asyncio
+import threading
+
+import pytest
+
+from shoalsoft.pants_mcp_plugin.goal_runner import GoalRunner
+
+# Upper bound on how long a test waits for a goal thread, so that a bug fails the test instead of
+# hanging it.
+_TIMEOUT_SECONDS = 10.0
+
+
+class _BlockingGoal:
+    """A goal function which blocks its thread until released, and records
+    how many times it was called."""
+
+    def __init__(self, result: str = "done") -> None:
+        self.result = result
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(_TIMEOUT_SECONDS)
+        return self.result
+
+
+async def _wait_for_thread_event(event: threading.Event) -> None:
+    assert await asyncio.to_thread(event.wait, _TIMEOUT_SECONDS)
+
+
+def _runner(max_concurrent_goals: int = 1, queue_size: int = 8) -> GoalRunner[str]:
+    return GoalRunner(max_concurrent_goals=max_concurrent_goals, queue_size=queue_size)
+
+
+def test_results_and_errors_are_delivered() -> None:
+    def failing_goal() -> str:
+        raise ValueError("goal failed")
+
+    async def run() -> None:
+        async with _runner() as goal_runner:
+            assert await goal_runner.run("ok", lambda: "ok") == "ok"
+            with pytest.raises(ValueError, match="goal failed"):
+                await goal_runner.run("failing", failing_goal)
+            # The worker survives a failing goal.
+            assert await goal_runner.run("again", lambda: "again") == "again"
+
+    asyncio.run(run())
+
+
+def test_default_single_worker_runs_goals_serially() -> None:
+    first = _BlockingGoal("first")
+    second = _BlockingGoal("second")
+
+    async def run() -> None:
+        async with _runner() as goal_runner:
+            first_task = asyncio.create_task(goal_runner.run("first", first))
+            second_task = asyncio.create_task(goal_runner.run("second", second))
+            await _wait_for_thread_event(first.started)
+
+            await asyncio.sleep(0.05)
+            assert not second.started.is_set()
+
+            first.release.set()
+            second.release.set()
+            assert await first_task == "first"
+            assert await second_task == "second"
+
+    asyncio.run(run())
+
+
+def test_workers_bound_concurrency() -> None:
+    goals = [_BlockingGoal(str(i)) for i in range(3)]
+
+    async def run() -> None:
+        async with _runner(max_concurrent_goals=2) as goal_runner:
+            tasks = [asyncio.create_task(goal_runner.run(goal.result, goal)) for goal in goals]
+            await _wait_for_thread_event(goals[0].started)
+            await _wait_for_thread_event(goals[1].started)
+
+            await asyncio.sleep(0.05)
+            assert not goals[2].started.is_set()
+
+            for goal in goals:
+                goal.release.set()
+            assert await asyncio.gather(*tasks) == ["0", "1", "2"]
+
+    asyncio.run(run())
+
+
+def test_exit_resolves_running_and_queued_goals() -> None:
+    running = _BlockingGoal()
+    queued = _BlockingGoal()
+    tasks: list[asyncio.Task[str]] = []
+
+    async def run() -> None:
+        try:
+            async with _runner() as goal_runner:
+                tasks.append(asyncio.create_task(goal_runner.run("running", running)))
+                tasks.append(asyncio.create_task(goal_runner.run("queued", queued)))
+                await _wait_for_thread_event(running.started)
+        finally:
+            # Let the goal thread finish so that `asyncio.run` can shut down its executor.
+            running.release.set()
+
+        # The worker was cancelled mid-run, and so the callers are cancelled instead of waiting
+        # forever.
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            assert isinstance(result, asyncio.CancelledError)
+        assert queued.calls == 0
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("max_concurrent_goals", [0, -1])
+def test_invalid_max_concurrent_goals(max_concurrent_goals: int) -> None:
+    with pytest.raises(ValueError, match="must be at least 1"):
+        _runner(max_concurrent_goals)
+
+
+def test_identical_calls_share_a_queued_goal_run() -> None:
+    blocker = _BlockingGoal()
+    shared = _BlockingGoal("shared")
+
+    async def run() -> None:
+        async with _runner() as goal_runner:
+            blocker_task = asyncio.create_task(goal_runner.run("blocker", blocker))
+            await _wait_for_thread_event(blocker.started)
+
+            async with asyncio.TaskGroup() as tg:
+                first = tg.create_task(goal_runner.run("key", shared))
+                second = tg.create_task(goal_runner.run("key", shared))
+                await asyncio.sleep(0)
+                blocker.release.set()
+                shared.release.set()
+
+            assert first.result() == second.result() == "shared"
+            await blocker_task
+
+        assert shared.calls == 1
+
+    asyncio.run(run())
+
+
+def test_calls_do_not_share_a_started_goal_run() -> None:
+    goal = _BlockingGoal()
+
+    async def run() -> None:
+        async with _runner(max_concurrent_goals=2) as goal_runner:
+            first = asyncio.create_task(goal_runner.run("key", goal))
+            await _wait_for_thread_event(goal.started)
+
+            # The first goal run has started, and so its result may be stale for this call.
+            second = asyncio.create_task(goal_runner.run("key", goal))
+            goal.release.set()
+            assert await first == await second == "done"
+
+        assert goal.calls == 2
+
+    asyncio.run(run())
+
+
+def test_cancelling_the_only_waiter_cancels_the_queued_goal_run() -> None:
+    blocker = _BlockingGoal()
+    cancelled = _BlockingGoal()
+
+    async def run() -> None:
+        async with _runner() as goal_runner:
+            blocker_task = asyncio.create_task(goal_runner.run("blocker", blocker))
+            await _wait_for_thread_event(blocker.started)
+
+            waiter = asyncio.create_task(goal_runner.run("key", cancelled))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+
+            # A later identical call queues a new goal run instead of joining the cancelled one.
+            blocker.release.set()
+            await blocker_task
+            assert await goal_runner.run("key", lambda: "fresh") == "fresh"
+
+        assert cancelled.calls == 0
+
+    asyncio.run(run())
+
+
+def test_goal_run_is_cancelled_only_after_the_last_waiter() -> None:
+    blocker = _BlockingGoal()
+    shared = _BlockingGoal("shared")
+
+    async def run() -> None:
+        async with _runner() as goal_runner:
+            blocker_task = asyncio.create_task(goal_runner.run("blocker", blocker))
+            await _wait_for_thread_event(blocker.started)
+
+            first = asyncio.create_task(goal_runner.run("key", shared))
+            second = asyncio.create_task(goal_runner.run("key", shared))
+            await asyncio.sleep(0)
+
+            first.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+
+            # The remaining waiter still gets the result.
+            blocker.release.set()
+            shared.release.set()
+            assert await second == "shared"
+            await blocker_task
+
+        assert shared.calls == 1
+
+    asyncio.run(run())
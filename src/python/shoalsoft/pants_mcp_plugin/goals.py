@@ -14,9 +14,7 @@
 from __future__ import annotations
 
 import asyncio
-import io
 import logging
-import os
 import sys
 from pathlib import Path
 
@@ -26,7 +24,7 @@ from pants.engine.goal import CurrentExecutingGoals
 from pants.engine.internals.session import SessionValues
 from pants.engine.rules import collect_rules
 from pants.goal.auxiliary_goal import AuxiliaryGoal, AuxiliaryGoalContext
-from pants.option.option_types import BoolOption
+from pants.option.option_types import BoolOption, IntOption
 from pants.option.options_bootstrapper import OptionsBootstrapper
 from shoalsoft.pants_mcp_plugin.mcp_server import get_query_rules, setup_and_run_mcp_server
 
@@ -45,37 +43,72 @@ class McpGoal(AuxiliaryGoal):
         help="Internal option used to invoke the MCP server. DO NOT USE DIRECTLY!",
     )
 
+    max_concurrent_goals = IntOption(
+        default=1,
+        advanced=True,
+        help=(
+            "Maximum number of Pants goals which the MCP server will run concurrently. By default, "
+            "goals are run one at a time. Values above 1 run multiple goals concurrently on the "
+            "same scheduler session, which is experimental."
+        ),
+    )
+
+    resources_page_size = IntOption(
+        default=1000,
+        advanced=True,
+        help=(
+            "Maximum number of resources which the MCP server returns for a single "
+            "`resources/list` request."
+        ),
+    )
+
     def _run_server(self, context: AuxiliaryGoalContext) -> ExitCode:
-        scheduler_session = context.graph_session.scheduler_session.scheduler.new_session(
+        if self.max_concurrent_goals < 1:
+            raise ValueError(
+                f"The `--{self.name}-max-concurrent-goals` option must be at least 1, "
+                f"got {self.max_concurrent_goals}."
+            )
+        if self.resources_page_size < 1:
+            raise ValueError(
+                f"The `--{self.name}-resources-page-size` option must be at least 1, "
+                f"got {self.resources_page_size}."
+            )
+
+        # The MCP server uses its own session (without the dynamic UI) on the same scheduler. The
+        # memoized graph belongs to the scheduler and so is shared with the session which started
+        # this goal. Reuse that session's options and environment so that the nodes which depend on
+        # them are shared as well instead of being recomputed under different inputs.
+        parent_session = context.graph_session.scheduler_session
+        parent_session_values = parent_session.py_session.session_values
+        scheduler_session = parent_session.scheduler.new_session(
             build_id="mcp",
             dynamic_ui=False,
             session_values=SessionValues(
                 {
-                    OptionsBootstrapper: OptionsBootstrapper.create(args=[], env={}),
-                    CompleteEnvironmentVars: CompleteEnvironmentVars([]),
+                    OptionsBootstrapper: parent_session_values[OptionsBootstrapper],
+                    CompleteEnvironmentVars: parent_session_values[CompleteEnvironmentVars],
                     CurrentExecutingGoals: CurrentExecutingGoals(),
                 }
             ),
         )
 
-        saved_stdout = sys.stdout
-        saved_stdin = sys.stdin
-        try:
-            sys.stdout = io.TextIOWrapper(os.fdopen(sys.stdout.fileno(), "wb", buffering=0))
-            sys.stdin = io.TextIOWrapper(os.fdopen(sys.stdin.fileno(), "rb", buffering=0))
-            asyncio.run(
-                setup_and_run_mcp_server(
-                    graph_session=context.graph_session,
-                    session=scheduler_session,
-                    build_root=Path.cwd(),
-                    union_membership=context.union_membership,
-                    build_config=context.build_config,
-                    options=context.options,
-                )
+        # The MCP server reads and writes the stdin/stdout file descriptors directly (see
+        # `stdio_transport.stdio_server`), and so the Python-level `sys.stdin` and `sys.stdout` are
+        # not used.
+        asyncio.run(
+            setup_and_run_mcp_server(
+                graph_session=context.graph_session,
+                session=scheduler_session,
+                build_root=Path.cwd(),
+                union_membership=context.union_membership,
+                build_config=context.build_config,
+                options=context.options,
+                stdin_fd=sys.stdin.fileno(),
+                stdout_fd=sys.stdout.fileno(),
+                max_concurrent_goals=self.max_concurrent_goals,
+                resources_page_size=self.resources_page_size,
             )
-        finally:
-            sys.stdout = saved_stdout
-            sys.stdin = saved_stdin
+        )
         return ExitCode(0)
 
     def run(
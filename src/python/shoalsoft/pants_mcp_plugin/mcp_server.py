@@ -14,17 +14,19 @@
 
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
+import functools
 import io
 import json
 import typing
-from collections.abc import Iterable, Mapping
+from collections.abc import Awaitable, Callable, Iterable, Mapping, Sequence
 from pathlib import Path
 from typing import Any
 
 from mcp import types as mcp_types
 from mcp.server.lowlevel import Server
 from mcp.server.lowlevel.helper_types import ReadResourceContents
-from mcp.server.stdio import stdio_server
 from pydantic.networks import AnyUrl
 
 from pants.base.specs import Specs
@@ -50,6 +52,8 @@ from pants.help.help_info_extracter import GoalHelpInfo, HelpInfoExtracter
 from pants.init.engine_initializer import GraphSession
 from pants.option.options import Options
 from pants.option.options_bootstrapper import OptionsBootstrapper
+from shoalsoft.pants_mcp_plugin.goal_runner import GoalRunner
+from shoalsoft.pants_mcp_plugin.stdio_transport import stdio_server
 
 try:
     from pants.core.environments.rules import (  # type: ignore[import-not-found, unused-ignore]
@@ -62,17 +66,64 @@ except ImportError:
 
 
 _PANTS_TARGET_ADDR_SCHEME = "pants-target"
+_PANTS_TARGET_URL_PREFIX = f"{_PANTS_TARGET_ADDR_SCHEME}://"
+_PANTS_TARGET_RESOURCE_DESCRIPTION = (
+    "A JSON document representing the metadata of this Pants target"
+)
+
+# Maximum number of goal invocations which may be waiting for a goal worker before further tool
+# calls are made to wait.
+_GOAL_QUEUE_SIZE = 64
+
+
+# JSON schemas for the goal tools. Only the description of the input parameter differs between
+# goals, and so the output schema is shared by all of the tools.
+_TOOL_INPUT_SCHEMA_TEMPLATE: dict[str, Any] = {
+    "type": "object",
+    "required": ["pants_target_address"],
+    "properties": {
+        "pants_target_address": {
+            "type": "string",
+        }
+    },
+}
+
+_TOOL_OUTPUT_SCHEMA: dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "exit_code": {
+            "type": "integer",
+            "description": "The exit code returned by the Pants goal",
+        },
+        "stdout": {
+            "type": "string",
+            "description": "Standard output captured from running the Pants goal",
+        },
+        "stderr": {
+            "type": "string",
+            "description": "Standard error output captured from running the Pants goal",
+        },
+    },
+    "required": ["exit_code", "stdout", "stderr"],
+}
+
+
+def _absolute_spec(spec: str) -> str:
+    """Make sure the spec is absolute so its URL form is parsed correctly."""
+    if not spec.startswith("//"):
+        return "//" + spec
+    return spec
 
 
 def _determine_available_goals(
     *,
     graph_session: GraphSession,
     scheduler_session: SchedulerSession,
+    env_name: EnvironmentName,
     union_membership: UnionMembership,
     build_config: BuildConfiguration,
     options: Options,
 ) -> dict[str, GoalHelpInfo]:
-    env_name = determine_bootstrap_environment(scheduler_session)
     build_symbols = scheduler_session.product_request(BuildFileSymbolsInfo, [Params(env_name)])[0]
     all_help_info = HelpInfoExtracter.get_all_help_info(
         options,
@@ -83,51 +134,31 @@ def _determine_available_goals(
         build_config,
     )
 
-    goal_name_to_goal_info: dict[str, GoalHelpInfo] = {}
-    for goal_info in all_help_info.name_to_goal_info.values():
-        if goal_info.is_implemented:
-            goal_name_to_goal_info[goal_info.name] = goal_info
-
-    return goal_name_to_goal_info
+    return {
+        goal_info.name: goal_info
+        for goal_info in all_help_info.name_to_goal_info.values()
+        if goal_info.is_implemented
+    }
 
 
 def _setup_tools(goal_name_to_goal_info: dict[str, GoalHelpInfo]) -> list[mcp_types.Tool]:
     tools: list[mcp_types.Tool] = []
     for goal_name, goal_info in goal_name_to_goal_info.items():
         input_schema = {
-            "type": "object",
-            "required": ["pants_target_address"],
+            **_TOOL_INPUT_SCHEMA_TEMPLATE,
             "properties": {
                 "pants_target_address": {
-                    "type": "string",
+                    **_TOOL_INPUT_SCHEMA_TEMPLATE["properties"]["pants_target_address"],
                     "description": f"The address of the Pants target to invoke with the `{goal_name}` goal ",
                 }
             },
         }
-        output_schema = {
-            "type": "object",
-            "properties": {
-                "exit_code": {
-                    "type": "integer",
-                    "description": f"The exit code returned by the Pants `{goal_name}` goal",
-                },
-                "stdout": {
-                    "type": "string",
-                    "description": f"Standard output captured from running the Pants `{goal_name}` goal",
-                },
-                "stderr": {
-                    "type": "string",
-                    "description": f"Standard error output captured from running the Pants `{goal_name}` goal",
-                },
-            },
-            "required": ["exit_code", "stdout", "stderr"],
-        }
         tool = mcp_types.Tool(
             name=f"pants-goal-{goal_name}",
             title=f"Run the Pants `{goal_name}` goal.",
             description=goal_info.description,
             inputSchema=input_schema,
-            outputSchema=output_schema,
+            outputSchema=_TOOL_OUTPUT_SCHEMA,
         )
         tools.append(tool)
 
@@ -136,20 +167,25 @@ def _setup_tools(goal_name_to_goal_info: dict[str, GoalHelpInfo]) -> list[mcp_ty
 
 def _setup_goal_map_from_rules(rules: Iterable[Rule]) -> Mapping[str, type[Goal]]:
     goal_map: dict[str, type[Goal]] = {}
+
+    def claim_goal_name(goal_name: str, rule: Rule, output_type: type[Goal]) -> None:
+        if goal_name in goal_map:
+            raise Exception(
+                f"could not map goal `{goal_name}` to rule `{rule}`: already claimed by product "
+                f"`{goal_map[goal_name]}`"
+            )
+        goal_map[goal_name] = output_type
+
     for rule in rules:
         output_type = getattr(rule, "output_type", None)
-        if not output_type or not issubclass(output_type, Goal):
+        if not isinstance(output_type, type) or not issubclass(output_type, Goal):
             continue
 
-        goal = output_type.name
+        claim_goal_name(output_type.name, rule, output_type)
         deprecated_goal = output_type.subsystem_cls.deprecated_options_scope
-        for goal_name in [goal, deprecated_goal] if deprecated_goal else [goal]:
-            if goal_name in goal_map:
-                raise Exception(
-                    f"could not map goal `{goal_name}` to rule `{rule}`: already claimed by product "
-                    f"`{goal_map[goal_name]}`"
-                )
-            goal_map[goal_name] = output_type
+        if deprecated_goal:
+            claim_goal_name(deprecated_goal, rule, output_type)
+
     return goal_map
 
 
@@ -169,32 +205,35 @@ async def setup_and_run_mcp_server(
     union_membership: UnionMembership,
     build_config: BuildConfiguration,
     options: Options,
+    stdin_fd: int,
+    stdout_fd: int,
+    max_concurrent_goals: int,
+    resources_page_size: int,
 ) -> None:
     server: Server = Server("shoalsoft-pants-mcp-plugin")
 
+    # These do not change over the lifetime of the server and so are only computed once.
+    env_name = determine_bootstrap_environment(session)
+    specs_parser = SpecsParser(root_dir=str(build_root))
+    workspace = Workspace(session)
+    options_bootstrapper = session.py_session.session_values[OptionsBootstrapper]
+
     goal_name_to_goal_info = _determine_available_goals(
         graph_session=graph_session,
         scheduler_session=session,
+        env_name=env_name,
         union_membership=union_membership,
         build_config=build_config,
         options=options,
     )
 
     tools = _setup_tools(goal_name_to_goal_info)
-    tools_by_name = {tool.name: tool for tool in tools}
+    tool_name_to_goal_name = {
+        f"pants-goal-{goal_name}": goal_name for goal_name in goal_name_to_goal_info
+    }
     goal_map = _setup_goal_map_from_rules(build_config.rules)
 
-    async def run_goal(goal_name: str, pants_target_address: str) -> dict[str, Any]:
-        env_name = determine_bootstrap_environment(session)
-
-        goal_product = goal_map.get(goal_name)
-        if goal_product is None:
-            raise ValueError(f"Unknown goal: {goal_name}")
-
-        specs = SpecsParser(root_dir=str(build_root)).parse_specs(
-            [pants_target_address], description_of_origin="MCP run_test_goal tool"
-        )
-
+    def run_goal_rule(goal_product: type[Goal], specs: Specs) -> dict[str, Any]:
         stdout, stderr = io.StringIO(), io.StringIO()
         console = Console(stdout=stdout, stderr=stderr, use_colors=False, session=session)
 
@@ -204,7 +243,7 @@ async def setup_and_run_mcp_server(
             Params(
                 specs,
                 console,
-                Workspace(session),
+                workspace,
                 env_name,
             ),
         )
@@ -215,73 +254,129 @@ async def setup_and_run_mcp_server(
             "stderr": stderr.getvalue(),
         }
 
+    # Goals are run by a fixed number of workers which each run the (blocking) goal rule in a
+    # thread. This keeps the event loop free to service other MCP requests while goals are running.
+    goal_runner: GoalRunner[dict[str, Any]] = GoalRunner(
+        max_concurrent_goals=max_concurrent_goals, queue_size=_GOAL_QUEUE_SIZE
+    )
+
+    async def run_goal(goal_name: str, pants_target_address: str) -> dict[str, Any]:
+        goal_product = goal_map.get(goal_name)
+        if goal_product is None:
+            raise ValueError(f"Unknown goal: {goal_name}")
+
+        # The specs are parsed for every call since parsing depends on the filesystem (e.g., whether
+        # the address is a file or a directory), which may change while the server is running.
+        specs = specs_parser.parse_specs(
+            [pants_target_address], description_of_origin="MCP run_test_goal tool"
+        )
+
+        # Identical tool calls made while a goal run is still queued share its result instead of
+        # running the goal again.
+        return await goal_runner.run(
+            (goal_name, pants_target_address),
+            functools.partial(run_goal_rule, goal_product, specs),
+        )
+
+    # Engine queries for resources are run in a dedicated thread so that they neither block the
+    # event loop nor compete with running goals for threads in the default executor. The single
+    # thread runs the queries one at a time, since running work concurrently on one scheduler
+    # session is unverified. A query may still overlap a running goal, which is the one deliberate
+    # departure from running everything serially.
+    query_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="pants-mcp-query"
+    )
+
+    async def product_request(product: type, subjects: Sequence[Any]) -> list[Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            query_executor, session.product_request, product, subjects
+        )
+
+    # The resources for the most recently listed `AllTargets`. The engine memoizes `AllTargets`, and
+    # so the same instance is returned until the targets are invalidated.
+    target_resources_cache: tuple[AllTargets, list[mcp_types.Resource]] | None = None
+
     async def get_pants_target_resources() -> list[mcp_types.Resource]:
-        result = session.product_request(AllTargets, [Params()])
-        targets: AllTargets = result[0]
+        nonlocal target_resources_cache
 
-        def abs_spec(spec: str) -> str:
-            """Make sure the spec is absolute so its URL form is parsed
-            correctly."""
-            if not spec.startswith("//"):
-                return "//" + spec
-            return spec
+        result = await product_request(AllTargets, [Params()])
+        targets: AllTargets = result[0]
+        if target_resources_cache is not None and target_resources_cache[0] is targets:
+            return target_resources_cache[1]
 
-        return [
+        resources = [
             mcp_types.Resource(
                 name=tgt.address.target_name,
-                uri=AnyUrl(f"{_PANTS_TARGET_ADDR_SCHEME}://{abs_spec(str(tgt.address))}"),
+                uri=AnyUrl(_PANTS_TARGET_URL_PREFIX + _absolute_spec(str(tgt.address))),
                 mimeType="text/json",
-                description="A JSON document representing the metadata of this Pants target",
+                description=_PANTS_TARGET_RESOURCE_DESCRIPTION,
             )
             for tgt in targets
         ]
+        target_resources_cache = (targets, resources)
+        return resources
+
+    async def call_goal_tool(goal_name: str, arguments: dict[str, Any]) -> dict[str, Any]:
+        # The MCP SDK has already validated the arguments against the tool's input schema, and so
+        # `pants_target_address` is present and a string.
+        return await run_goal(goal_name, arguments["pants_target_address"])
+
+    # Dispatch table from tool name to the handler for the tool.
+    tool_handlers: dict[str, Callable[[dict[str, Any]], Awaitable[dict[str, Any]]]] = {
+        tool_name: functools.partial(call_goal_tool, goal_name)
+        for tool_name, goal_name in tool_name_to_goal_name.items()
+    }
 
     @server.call_tool()
     async def call_tool(name: str, arguments: dict[str, Any]) -> dict[str, Any]:
-        if name not in tools_by_name:
+        tool_handler = tool_handlers.get(name)
+        if tool_handler is None:
             raise ValueError(f"Unknown tool: {name}")
 
-        goal_name = name.split("-")[2]
-
-        if "pants_target_address" not in arguments:
-            raise ValueError(f"Parameter `pants_target_address` is required for tool `{name}`.")
-        pants_target_address = arguments.get("pants_target_address")
-        if pants_target_address is None or not isinstance(pants_target_address, str):
-            raise ValueError(
-                f"Expected parameter `pants_target_address` for tool `{name}` to be a `str`."
-            )
-        return await run_goal(goal_name, pants_target_address)
+        return await tool_handler(arguments)
 
     @server.list_tools()
     async def list_tools() -> list[mcp_types.Tool]:
         return tools
 
-    @server.list_resources()
-    async def list_resources() -> list[mcp_types.Resource]:
-        target_resources = await get_pants_target_resources()
-        return target_resources
+    # Registered directly as a request handler since the `Server.list_resources` decorator does not
+    # provide the pagination cursor to the handler.
+    async def list_resources(request: mcp_types.ListResourcesRequest) -> mcp_types.ServerResult:
+        cursor = request.params.cursor if request.params else None
+        try:
+            start = int(cursor) if cursor else 0
+        except ValueError:
+            start = -1
+        if start < 0:
+            raise ValueError(f"Invalid cursor: {cursor}")
 
-    def resolve_specs_to_addresses(raw_specs: Iterable[str]) -> Addresses:
-        specs = SpecsParser(root_dir=str(build_root)).parse_specs(
-            specs=raw_specs, description_of_origin=""
-        )
-        options_bootstrapper = session.py_session.session_values[OptionsBootstrapper]
-        env_name = determine_bootstrap_environment(session)
-        results = session.product_request(
-            Addresses, [Params(specs, options_bootstrapper, env_name)]
+        target_resources = await get_pants_target_resources()
+        end = start + resources_page_size
+        return mcp_types.ServerResult(
+            mcp_types.ListResourcesResult(
+                resources=target_resources[start:end],
+                nextCursor=str(end) if end < len(target_resources) else None,
+            )
         )
+
+    server.request_handlers[mcp_types.ListResourcesRequest] = list_resources
+
+    async def resolve_specs_to_addresses(raw_specs: Iterable[str]) -> Addresses:
+        specs = specs_parser.parse_specs(specs=raw_specs, description_of_origin="")
+        results = await product_request(Addresses, [Params(specs, options_bootstrapper, env_name)])
         return typing.cast(Addresses, results[0])
 
     async def read_pants_target_resource(url: AnyUrl) -> Iterable[ReadResourceContents]:
         spec = url.path
         assert spec is not None, "MCP URL must not be empty."
-        addresses = resolve_specs_to_addresses([spec])
+        addresses = await resolve_specs_to_addresses([spec])
         if not addresses:
             raise ValueError(f"No Pants target found for `{spec}`")
         if len(addresses) != 1:
             raise ValueError(f"Multiple Pants targets matched spec `{spec}`.")
 
-        results = session.product_request(
+        results = await product_request(
             WrappedTarget,
             [WrappedTargetRequest(addresses[0], description_of_origin="MCP server")],
         )
@@ -305,5 +400,15 @@ async def setup_and_run_mcp_server(
 
         raise ValueError(f"Unknown resource: {url}")
 
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(read_stream, write_stream, server.create_initialization_options())
+    # All handlers are registered by now, and so the capabilities advertised to the client are
+    # fixed. Build the initialization options before any I/O starts.
+    initialization_options = server.create_initialization_options()
+
+    try:
+        async with goal_runner, stdio_server(stdin_fd=stdin_fd, stdout_fd=stdout_fd) as (
+            read_stream,
+            write_stream,
+        ):
+            await server.run(read_stream, write_stream, initialization_options)
+    finally:
+        query_executor.shutdown(wait=False, cancel_futures=True)
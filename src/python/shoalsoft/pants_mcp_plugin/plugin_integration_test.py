@@ -12,21 +12,26 @@
 # SOFTWARE.
 
 import asyncio
+import functools
 import json
 import os
+import shutil
 import subprocess
 import tempfile
 import textwrap
 import typing
-from collections.abc import Iterable, Mapping
-from contextlib import contextmanager
+import zipfile
+from collections.abc import AsyncIterator, Iterable, Mapping
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
 from typing import Any, Generator
 
 import pytest
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
 from mcp import ClientSession
 from mcp import types as mcp_types
-from mcp.client.stdio import StdioServerParameters, stdio_client
+from mcp.shared.exceptions import McpError
+from mcp.shared.message import SessionMessage
 from packaging.version import Version
 from pydantic.networks import AnyUrl
 
@@ -40,6 +45,61 @@ from shoalsoft.pants_mcp_plugin.pants_integration_testutil import (
     run_pants_with_workdir,
     run_pants_with_workdir_without_waiting,
 )
+from shoalsoft.pants_mcp_plugin.stdio_transport import MAX_MESSAGE_SIZE, json_rpc_message_streams
+
+
+# The `pants.toml` written into the build root of each isolated Pants.
+_PANTS_TOML_TEMPLATE = textwrap.dedent(
+    """\
+    [GLOBAL]
+    pants_version = "{pants_version}"
+    pythonpath = ["{site_packages_path}"]
+    backend_packages = [
+      "pants.backend.python",
+      "pants.backend.shell",
+      "shoalsoft.pants_mcp_plugin",
+    ]
+    print_stacktrace = true
+    pantsd = false
+
+    [python]
+    interpreter_constraints = "==3.11.*"
+    pip_version = "latest"
+
+    [pex-cli]
+    version = "v2.45.2"
+    known_versions = [
+    "v2.45.2|macos_arm64|570a3d5ca306a39aa3a180bd4cf3e2661b7c74b0579422b34659246daf122384|4833957",
+    "v2.45.2|macos_x86_64|570a3d5ca306a39aa3a180bd4cf3e2661b7c74b0579422b34659246daf122384|4833957",
+    "v2.45.2|linux_arm64|570a3d5ca306a39aa3a180bd4cf3e2661b7c74b0579422b34659246daf122384|4833957",
+    "v2.45.2|linux_x86_64|570a3d5ca306a39aa3a180bd4cf3e2661b7c74b0579422b34659246daf122384|4833957",
+    ]
+    """
+)
+
+
+# The Pants versions against which the plugin is tested.
+_PANTS_MAJOR_MINOR_VERSIONS = ("2.29", "2.28", "2.27")
+
+# The first Pants version which runs on Python 3.11.
+_MIN_PANTS_VERSION_FOR_PY311 = Version("2.25")
+
+# The number of resources the MCP server returns per `resources/list` request in the tests.
+_RESOURCES_PAGE_SIZE = 1
+
+# How long to wait for the MCP server to start and respond to the `initialize` request.
+_SERVER_STARTUP_TIMEOUT_SECONDS = 180.0
+
+# How long to wait for the MCP server to exit once the client closes its stdin.
+_SERVER_EXIT_TIMEOUT_SECONDS = 10.0
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_python_interpreter_path(version: str) -> str | None:
+    """Find the Python interpreter for the version only once per test
+    process, since `isolated_pants` is called for each parametrized Pants
+    version."""
+    return python_interpreter_path(version)
 
 
 def _safe_write_files(base_path: str | os.PathLike, files: Mapping[str, str | bytes]) -> None:
@@ -60,12 +120,46 @@ class IsolatedPantsTestContext:
         self.workdir_base = workdir_base
         self.pants_exe_args = list(pants_exe_args)
         self.extra_env = extra_env
+        self._workdir_pool: list[Path] = []
+
+    @contextmanager
+    def _acquire_workdir(self, fresh: bool) -> Generator[str, None, None]:
+        """Provide a Pants workdir which no other Pants invocation is using.
+
+        Released workdirs are kept in a pool and reused as is by later
+        invocations (like the `.pants.d` of a regular repository), so a
+        test which runs Pants sequentially uses a single workdir. A new
+        workdir is only created for invocations which run concurrently.
+        If `fresh` is set, then a reused workdir is emptied first so the
+        invocation does not see state left behind by earlier invocations.
+        """
+        if self._workdir_pool:
+            workdir = self._workdir_pool.pop()
+            if fresh:
+                with os.scandir(workdir) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path)
+                        else:
+                            os.unlink(entry.path)
+        else:
+            workdir = Path(tempfile.mkdtemp(dir=self.workdir_base))
+        try:
+            yield str(workdir)
+        finally:
+            self._workdir_pool.append(workdir)
+
+    def cleanup(self) -> None:
+        """Remove the build root (including all of the workdirs within it)
+        once the test is done with this Pants."""
+        self._workdir_pool.clear()
+        shutil.rmtree(self.buildroot, ignore_errors=True)
 
     @contextmanager
     def prepared_pants_invocation(
-        self, args: Iterable[str]
+        self, args: Iterable[str], *, fresh_workdir: bool = False
     ) -> Generator[PreparedPantsInvocation, None, None]:
-        with tempfile.TemporaryDirectory(dir=self.workdir_base) as workdir:
+        with self._acquire_workdir(fresh_workdir) as workdir:
             yield prepare_pants_invocation(
                 command=list(args),
                 pants_exe_args=self.pants_exe_args,
@@ -74,8 +168,8 @@ class IsolatedPantsTestContext:
                 extra_env=self.extra_env,
             )
 
-    def run_pants(self, args: Iterable[str]) -> PantsResult:
-        with tempfile.TemporaryDirectory(dir=self.workdir_base) as workdir:
+    def run_pants(self, args: Iterable[str], *, fresh_workdir: bool = False) -> PantsResult:
+        with self._acquire_workdir(fresh_workdir) as workdir:
             return run_pants_with_workdir(
                 command=list(args),
                 pants_exe_args=self.pants_exe_args,
@@ -86,9 +180,9 @@ class IsolatedPantsTestContext:
 
     @contextmanager
     def run_pants_without_waiting(
-        self, args: Iterable[str]
+        self, args: Iterable[str], *, fresh_workdir: bool = False
     ) -> Generator[PantsJoinHandle, None, None]:
-        with tempfile.TemporaryDirectory(dir=self.workdir_base) as workdir:
+        with self._acquire_workdir(fresh_workdir) as workdir:
             yield run_pants_with_workdir_without_waiting(
                 command=list(args),
                 pants_exe_args=self.pants_exe_args,
@@ -98,8 +192,9 @@ class IsolatedPantsTestContext:
             )
 
 
-@contextmanager
-def isolated_pants(pants_major_minor: str):
+def _python_for_pants(pants_major_minor: str) -> str:
+    """Return the path to a Python interpreter compatible with the Pants
+    version."""
     pants_major_minor_version = Version(pants_major_minor)
     assert (
         len(pants_major_minor_version.release) == 2
@@ -107,42 +202,150 @@ def isolated_pants(pants_major_minor: str):
 
     # Find the Python interpreter compatible with this version of Pants.
     py_version_for_pants_major_minor = (
-        "3.11" if pants_major_minor_version >= Version("2.25") else "3.9"
+        "3.11" if pants_major_minor_version >= _MIN_PANTS_VERSION_FOR_PY311 else "3.9"
     )
-    python_path = python_interpreter_path(py_version_for_pants_major_minor)
+    python_path = _cached_python_interpreter_path(py_version_for_pants_major_minor)
     assert (
         python_path
     ), f"Did not find a compatible Python interpreter for test: Pants v{pants_major_minor}"
+    return python_path
 
-    # Install a venv expanded from the plugin's pex file. (The BUILD file arranges for the pex files to be materialized
-    # in the sandbox as dependencies.)
-    plugin_venv_path = (Path.cwd() / f"plugin-venv-{pants_major_minor}").resolve()
-    plugin_venv_path.mkdir(parents=True)
-    plugin_pex_files = [
-        name
-        for name in os.listdir(Path.cwd())
-        if name.startswith(f"shoalsoft-pants-mcp-plugin-pants{pants_major_minor}")
-        and name.endswith(".pex")
-    ]
+
+def _find_plugin_pex(pants_major_minor: str, sandbox_dir: Path) -> Path:
+    """Find the plugin's pex file for the Pants version."""
+    # (The BUILD file arranges for the pex files to be materialized in the sandbox as dependencies.)
+    plugin_pex_files = list(
+        sandbox_dir.glob(f"shoalsoft-pants-mcp-plugin-pants{pants_major_minor}*.pex")
+    )
     assert (
         len(plugin_pex_files) == 1
     ), f"Expected to find exactly one pex file for Pants {pants_major_minor}."
-    subprocess.run(
-        [python_path, plugin_pex_files[0], "venv", str(plugin_venv_path)],
-        env={"PEX_TOOLS": "1"},
-        check=True,
-    )
-    site_packages_path = (
-        plugin_venv_path / "lib" / f"python{py_version_for_pants_major_minor}" / "site-packages"
-    )
+
+    plugin_pex_path = plugin_pex_files[0].resolve()
+    # Check that the pex is a zip file here rather than have the venv expansion fail.
+    assert zipfile.is_zipfile(
+        plugin_pex_path
+    ), f"Expected the plugin pex file `{plugin_pex_path}` to be a valid zip file."
+    return plugin_pex_path
+
+
+async def _expand_plugin_venv(pants_major_minor: str) -> Path:
+    """Install a venv expanded from the plugin's pex file for the Pants
+    version and return its path."""
+    python_path = _python_for_pants(pants_major_minor)
+    sandbox_dir = Path.cwd()
+    plugin_pex_path = _find_plugin_pex(pants_major_minor, sandbox_dir)
+
+    plugin_venv_path = sandbox_dir / f"plugin-venv-{pants_major_minor}"
+    plugin_venv_path.mkdir(parents=True)
+    args = [python_path, str(plugin_pex_path), "venv", str(plugin_venv_path)]
+    # Python only creates non-inheritable file descriptors, and so `close_fds=False` is safe. It lets
+    # `subprocess` spawn the process with `posix_spawn` instead of fork/exec.
+    process = await asyncio.create_subprocess_exec(*args, env={"PEX_TOOLS": "1"}, close_fds=False)
+    try:
+        returncode = await process.wait()
+    except BaseException:
+        # Do not leave the `pex venv` process running if the expansion is cancelled.
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+    return plugin_venv_path
+
+
+async def _cancel_leftover_tasks() -> None:
+    current_task = asyncio.current_task()
+    leftover_tasks = [task for task in asyncio.all_tasks() if task is not current_task]
+    for task in leftover_tasks:
+        task.cancel()
+    await asyncio.gather(*leftover_tasks, return_exceptions=True)
+
+
+@pytest.fixture(scope="session")
+def shared_asyncio_runner() -> Generator[asyncio.Runner, None, None]:
+    """Provide a single event loop for all of the tests to run their async
+    code on, instead of creating a new event loop for each test.
+
+    Since the loop is shared, anything a test leaves running on it could
+    affect later tests. Tests should use the `asyncio_runner` fixture,
+    which cancels leftover tasks after each test.
+    """
+    with asyncio.Runner() as runner:
+        yield runner
+
+
+@pytest.fixture
+def asyncio_runner(
+    shared_asyncio_runner: asyncio.Runner,
+) -> Generator[asyncio.Runner, None, None]:
+    """Provide the shared event loop to a single test, and cancel any tasks
+    the test leaves behind once it finishes.
+
+    Threads started by the test (e.g., via `asyncio.to_thread`) cannot
+    be cancelled, and so tests must not leave any running.
+    """
+    yield shared_asyncio_runner
+    shared_asyncio_runner.run(_cancel_leftover_tasks())
+
+
+@pytest.fixture(scope="session")
+def expanded_plugin_venvs(
+    request: pytest.FixtureRequest, shared_asyncio_runner: asyncio.Runner
+) -> dict[str, Path | Exception]:
+    """Expand the plugin venvs for the Pants versions of the collected tests
+    concurrently, instead of one at a time as each version is tested.
+
+    Only the versions which will actually be tested are expanded, and so
+    selecting a single version (e.g., with `-k 2.29`) only expands the
+    venv for that version.
+
+    Each Pants version maps to the path of its venv, or to the error
+    from expanding it. The error is only raised by the tests for that
+    version, so that one broken version does not fail the tests for the
+    other versions.
+    """
+    collected_pants_versions = {
+        callspec.params["pants_version_str"]
+        for item in request.session.items
+        if (callspec := getattr(item, "callspec", None)) is not None
+        and "pants_version_str" in callspec.params
+    }
+    pants_versions = [v for v in _PANTS_MAJOR_MINOR_VERSIONS if v in collected_pants_versions]
+
+    async def expand(pants_major_minor: str) -> Path | Exception:
+        try:
+            return await _expand_plugin_venv(pants_major_minor)
+        except Exception as e:
+            return e
+
+    async def expand_all() -> dict[str, Path | Exception]:
+        # If the expansion is interrupted, then the task group cancels (and awaits) all of the
+        # expansions which are still running.
+        async with asyncio.TaskGroup() as tg:
+            tasks = {v: tg.create_task(expand(v)) for v in pants_versions}
+        return {v: task.result() for v, task in tasks.items()}
+
+    return shared_asyncio_runner.run(expand_all())
+
+
+@contextmanager
+def isolated_pants(pants_major_minor: str, plugin_venv_path: Path):
+    python_path = _python_for_pants(pants_major_minor)
+
+    # The current directory is already an absolute path without symlinks, and so paths created
+    # within it do not need to be resolved.
+    sandbox_dir = Path.cwd()
 
     # A pex of the Pants version in this resolve is materialised as `pants-MAJOR.MINOR.pex` in the sandbox.
     # This is done to isolate the test environment's virtualenv from the Pants under test.
-    pants_pex_path = (Path.cwd() / f"pants-{pants_major_minor}.pex").resolve()
+    pants_pex_path = (sandbox_dir / f"pants-{pants_major_minor}.pex").resolve()
     assert pants_pex_path.exists(), f"Expected to find pants-{pants_major_minor}.pex in sandbox."
 
-    buildroot = (Path.cwd() / f"buildroot-{pants_major_minor}").resolve()
-    buildroot.mkdir(parents=True)
+    # Each isolated Pants gets its own build root so that the same Pants version can be used by more
+    # than one test.
+    buildroot = Path(tempfile.mkdtemp(prefix=f"buildroot-{pants_major_minor}-", dir=sandbox_dir))
     (buildroot / "BUILDROOT").touch()
 
     # Determine the full version of the Pants used for the test.
@@ -161,35 +364,16 @@ def isolated_pants(pants_major_minor: str):
     pants_exe_args = [str(pants_pex_path)]
     extra_env = {"PEX_PYTHON": python_path}
 
-    safe_file_dump(
-        str(buildroot / "pants.toml"),
-        textwrap.dedent(
-            f"""\
-        [GLOBAL]
-        pants_version = "{pants_version}"
-        pythonpath = ["{site_packages_path}"]
-        backend_packages = [
-          "pants.backend.python",
-          "pants.backend.shell",
-          "shoalsoft.pants_mcp_plugin",
-        ]
-        print_stacktrace = true
-        pantsd = false
-
-        [python]
-        interpreter_constraints = "==3.11.*"
-        pip_version = "latest"
-
-        [pex-cli]
-        version = "v2.45.2"
-        known_versions = [
-        "v2.45.2|macos_arm64|570a3d5ca306a39aa3a180bd4cf3e2661b7c74b0579422b34659246daf122384|4833957",
-        "v2.45.2|macos_x86_64|570a3d5ca306a39aa3a180bd4cf3e2661b7c74b0579422b34659246daf122384|4833957",
-        "v2.45.2|linux_arm64|570a3d5ca306a39aa3a180bd4cf3e2661b7c74b0579422b34659246daf122384|4833957",
-        "v2.45.2|linux_x86_64|570a3d5ca306a39aa3a180bd4cf3e2661b7c74b0579422b34659246daf122384|4833957",
-        ]
-        """
-        ),
+    # Find the venv's site-packages rather than assume the Python version the pex tool used for it.
+    site_packages_paths = list(plugin_venv_path.glob("lib/python*/site-packages"))
+    assert (
+        len(site_packages_paths) == 1
+    ), f"Expected to find exactly one site-packages directory in `{plugin_venv_path}`."
+
+    (buildroot / "pants.toml").write_text(
+        _PANTS_TOML_TEMPLATE.format(
+            pants_version=pants_version, site_packages_path=site_packages_paths[0]
+        )
     )
 
     isolated_pants_test_context = IsolatedPantsTestContext(
@@ -199,7 +383,68 @@ def isolated_pants(pants_major_minor: str):
         extra_env=extra_env,
     )
 
-    yield isolated_pants_test_context
+    try:
+        yield isolated_pants_test_context
+    finally:
+        isolated_pants_test_context.cleanup()
+
+
+@asynccontextmanager
+async def _stdio_pipe_client(
+    command: list[str], *, env: Mapping[str, str], cwd: str
+) -> AsyncIterator[
+    tuple[
+        MemoryObjectReceiveStream[SessionMessage | Exception],
+        MemoryObjectSendStream[SessionMessage],
+    ]
+]:
+    """Client transport for a MCP server run as a subprocess over stdio.
+
+    Unlike `mcp.client.stdio.stdio_client`, messages are read and
+    written over asyncio pipe transports attached to the subprocess'
+    stdin/stdout, using the same message handling as the server.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        env=env,
+        cwd=cwd,
+        limit=MAX_MESSAGE_SIZE,
+    )
+    assert process.stdin is not None and process.stdout is not None
+    try:
+        async with json_rpc_message_streams(process.stdout, process.stdin) as streams:
+            yield streams
+    finally:
+        # Closing stdin signals the server to exit. Terminate it if it does not exit promptly.
+        process.stdin.close()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=_SERVER_EXIT_TIMEOUT_SECONDS)
+        except TimeoutError:
+            process.terminate()
+            await process.wait()
+
+
+@asynccontextmanager
+async def _mcp_client_session(invocation: PreparedPantsInvocation) -> AsyncIterator[ClientSession]:
+    """Start the MCP server for the invocation and provide an initialized
+    client session for it.
+
+    Starting the server is by far the most expensive part of a test, and
+    so the session should be shared by all of the checks against the
+    same server.
+    """
+    async with _stdio_pipe_client(
+        invocation.pants_command,
+        env={str(key): str(value) for key, value in invocation.env.items()},
+        cwd=invocation.cwd,
+    ) as (reader, writer):
+        async with ClientSession(reader, writer) as session:
+            # The server only responds once Pants has started and the server is set up. Bound the
+            # wait so that a server which hangs during startup fails the test promptly.
+            await asyncio.wait_for(session.initialize(), timeout=_SERVER_STARTUP_TIMEOUT_SECONDS)
+            yield session
 
 
 async def _test_tools(session: ClientSession) -> None:
@@ -244,14 +489,27 @@ async def _test_tools(session: ClientSession) -> None:
 
 
 async def _test_resources(session: ClientSession) -> None:
-    resources_result = await session.list_resources()
-    resources = {resource.uri.path: resource for resource in resources_result.resources}
+    resources: dict[str | None, mcp_types.Resource] = {}
+    cursor: str | None = None
+    pages = 0
+    while True:
+        resources_result = await session.list_resources(cursor=cursor)
+        pages += 1
+        assert len(resources_result.resources) <= _RESOURCES_PAGE_SIZE
+        resources.update((resource.uri.path, resource) for resource in resources_result.resources)
+        cursor = resources_result.nextCursor
+        if cursor is None:
+            break
     assert resources, "MCP server should have returned resources."
-    for expected_tgt_spec in ("//:test_tgt",):
+    assert pages > 1, "Expected the resources to be listed over several pages."
+    for expected_tgt_spec in ("//:test_tgt", "//:other_tgt"):
         assert (
-            "//:test_tgt" in resources
+            expected_tgt_spec in resources
         ), f"Expected a resource for Pants target `{expected_tgt_spec}`"
 
+    with pytest.raises(McpError, match="Invalid cursor"):
+        await session.list_resources(cursor="not-a-cursor")
+
     async def get_pants_target_resource(spec: str) -> dict[str, typing.Any]:
         resource_result = await session.read_resource(AnyUrl(f"pants-target://{spec}"))
         contents = resource_result.contents
@@ -275,40 +533,45 @@ async def _test_resources(session: ClientSession) -> None:
     assert test_tgt["address"] == "//:test_tgt"
 
 
-@pytest.mark.parametrize("pants_version_str", ("2.29", "2.28", "2.27"))
-def test_mcp_server_tools(pants_version_str: str) -> None:
-    with isolated_pants(pants_version_str) as context:
+@pytest.mark.parametrize("pants_version_str", _PANTS_MAJOR_MINOR_VERSIONS)
+def test_mcp_server_tools(
+    pants_version_str: str,
+    asyncio_runner: asyncio.Runner,
+    expanded_plugin_venvs: dict[str, Path | Exception],
+) -> None:
+    plugin_venv_path = expanded_plugin_venvs[pants_version_str]
+    if isinstance(plugin_venv_path, Exception):
+        raise plugin_venv_path
+
+    with isolated_pants(pants_version_str, plugin_venv_path) as context:
         sources = {
-            "BUILD": """test_shell_command(name="test_tgt", command="echo xyzzy ; exit 1")\n""",
+            "BUILD": textwrap.dedent(
+                """\
+                test_shell_command(name="test_tgt", command="echo xyzzy ; exit 1")
+                test_shell_command(name="other_tgt", command="true")
+                """
+            ),
         }
         _safe_write_files(context.buildroot, sources)
 
-        result1 = context.run_pants(["help", "goals"])
-        result1.assert_success()
-        assert "shoalsoft-mcp" in result1.stdout, "The `shoalsoft-mcp` goal was not configured."
-
+        # Running the `shoalsoft-mcp` goal is itself the check that the plugin's goal is configured,
+        # and so there is no separate (and slow) `help goals` invocation.
+        # A small page size makes the resources be listed over several pages.
         with context.prepared_pants_invocation(
-            ["shoalsoft-mcp", "--run-stdio-server"]
+            [
+                "shoalsoft-mcp",
+                "--run-stdio-server",
+                f"--resources-page-size={_RESOURCES_PAGE_SIZE}",
+            ]
         ) as invocation:
 
             async def _run_client_test() -> None:
-                server_params = StdioServerParameters(
-                    command=invocation.pants_command[0],
-                    args=invocation.pants_command[1:],
-                    env={str(key): str(value) for key, value in invocation.env.items()},
-                    cwd=invocation.cwd,
-                )
-                async with stdio_client(server_params) as (reader, writer):
-                    async with ClientSession(reader, writer) as session:
-                        await session.initialize()
-
-                        try:
-                            await _test_tools(session)
-                            await _test_resources(session)
-                        except Exception as e:
-                            # This seems to be necessary with the asyncio since the exception is not
-                            # propagating back to pytest for some reason.
-                            print(f"EXCEPTION: {e}")
-                            raise
-
-            asyncio.run(_run_client_test())
+                async with _mcp_client_session(invocation) as session:
+                    # The tools and resources are independent, and so are tested concurrently over
+                    # the same session. Any failure propagates as an `ExceptionGroup`, which pytest
+                    # reports with the traceback of each sub-exception.
+                    async with asyncio.TaskGroup() as tg:
+                        tg.create_task(_test_tools(session))
+                        tg.create_task(_test_resources(session))
+
+            asyncio_runner.run(_run_client_test())
@@ -0,0 +1,204 @@
+# Copyright (C) 2025 Shoal Software LLC. All rights reserved.
+#
+# This is commercial software and cannot be used without prior permission.
+# See the included LICENSE file for further specific terms and conditions.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import stat
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import anyio
+import anyio.lowlevel
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
+from mcp import types as mcp_types
+from mcp.server.stdio import stdio_server as mcp_stdio_server
+from mcp.shared.message import SessionMessage
+
+# Maximum size of a single JSON-RPC message (i.e., line) read from a pipe. The asyncio default of
+# 64 KiB is too small for tool calls with large arguments.
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# The file descriptor of the process' stderr.
+_STDERR_FD = 2
+
+
+@asynccontextmanager
+async def json_rpc_message_streams(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> AsyncIterator[
+    tuple[
+        MemoryObjectReceiveStream[SessionMessage | Exception],
+        MemoryObjectSendStream[SessionMessage],
+    ]
+]:
+    """Exchange newline-delimited JSON-RPC messages over an asyncio stream
+    reader and writer.
+
+    This is shared by the server transport and by clients which talk to
+    a server over the pipes of a subprocess.
+    """
+    read_stream: MemoryObjectReceiveStream[SessionMessage | Exception]
+    read_stream_writer: MemoryObjectSendStream[SessionMessage | Exception]
+
+    write_stream: MemoryObjectSendStream[SessionMessage]
+    write_stream_reader: MemoryObjectReceiveStream[SessionMessage]
+
+    read_stream_writer, read_stream = anyio.create_memory_object_stream(0)
+    write_stream, write_stream_reader = anyio.create_memory_object_stream(0)
+
+    async def message_reader() -> None:
+        try:
+            async with read_stream_writer:
+                while True:
+                    try:
+                        line = await reader.readline()
+                    except ValueError as exc:
+                        # The line is longer than the reader's limit. Report it like an invalid
+                        # message instead of failing the transport, and carry on with the next line.
+                        await read_stream_writer.send(exc)
+                        continue
+                    if not line:
+                        break
+
+                    try:
+                        message = mcp_types.JSONRPCMessage.model_validate_json(line)
+                    except Exception as exc:
+                        await read_stream_writer.send(exc)
+                        continue
+
+                    await read_stream_writer.send(SessionMessage(message))
+        except anyio.ClosedResourceError:
+            await anyio.lowlevel.checkpoint()
+
+    async def message_writer() -> None:
+        try:
+            async with write_stream_reader:
+                async for session_message in write_stream_reader:
+                    payload = session_message.message.model_dump_json(
+                        by_alias=True, exclude_none=True
+                    )
+                    writer.write(payload.encode("utf-8") + b"\n")
+                    await writer.drain()
+        except anyio.ClosedResourceError:
+            await anyio.lowlevel.checkpoint()
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(message_reader)
+        tg.start_soon(message_writer)
+        try:
+            yield read_stream, write_stream
+        finally:
+            # The reader may still be waiting for a line from the other end (e.g., a client whose
+            # server is still running), and so is stopped instead of waiting for EOF.
+            tg.cancel_scope.cancel()
+
+
+@asynccontextmanager
+async def stdio_pipe_server(*, stdin_fd: int, stdout_fd: int) -> AsyncIterator[
+    tuple[
+        MemoryObjectReceiveStream[SessionMessage | Exception],
+        MemoryObjectSendStream[SessionMessage],
+    ]
+]:
+    """Server transport for stdio which is a drop-in replacement for
+    `mcp.server.stdio.stdio_server`.
+
+    The MCP SDK reads stdin by offloading each `readline` to a worker
+    thread. This transport instead attaches asyncio pipe transports to
+    the stdin/stdout file descriptors so that messages are read and
+    written directly by the event loop.
+
+    The pipe transports put the file descriptors into non-blocking mode
+    for as long as the server runs. Since that mode is shared by every
+    file descriptor for the same open file, anything else writing to
+    the same file (e.g., stderr redirected to stdout) may fail with
+    `BlockingIOError`. Use `stdio_server` to only use this transport
+    when that cannot happen.
+    """
+    loop = asyncio.get_running_loop()
+
+    # The pipe transports put the file descriptors into non-blocking mode. Remember the original
+    # mode so it can be restored for Pants once the server exits.
+    saved_blocking = {fd: os.get_blocking(fd) for fd in (stdin_fd, stdout_fd)}
+
+    # Use `closefd=False` so that closing the transports does not close the process' stdin/stdout.
+    stdin = os.fdopen(stdin_fd, "rb", buffering=0, closefd=False)
+    stdout = os.fdopen(stdout_fd, "wb", buffering=0, closefd=False)
+
+    reader = asyncio.StreamReader(limit=MAX_MESSAGE_SIZE)
+    read_transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), stdin
+    )
+    write_transport, write_protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, stdout
+    )
+    writer = asyncio.StreamWriter(write_transport, write_protocol, None, loop)
+
+    try:
+        async with json_rpc_message_streams(reader, writer) as (read_stream, write_stream):
+            yield read_stream, write_stream
+    finally:
+        read_transport.close()
+        writer.close()
+        for fd, blocking in saved_blocking.items():
+            os.set_blocking(fd, blocking)
+
+
+def can_use_pipe_transports(stdin_fd: int, stdout_fd: int) -> bool:
+    """Return whether `stdio_pipe_server` can safely be used for the file
+    descriptors.
+
+    They must be pipes or sockets (and not, e.g., a terminal or a
+    regular file), and must not be the same file as stderr, which would
+    otherwise be put into non-blocking mode as well.
+    """
+    try:
+        fd_stats = [os.fstat(fd) for fd in (stdin_fd, stdout_fd)]
+    except OSError:
+        return False
+    if not all(stat.S_ISFIFO(st.st_mode) or stat.S_ISSOCK(st.st_mode) for st in fd_stats):
+        return False
+
+    try:
+        stderr_stat = os.fstat(_STDERR_FD)
+    except OSError:
+        return True
+    return not any(os.path.samestat(st, stderr_stat) for st in fd_stats)
+
+
+@asynccontextmanager
+async def stdio_server(*, stdin_fd: int, stdout_fd: int) -> AsyncIterator[
+    tuple[
+        MemoryObjectReceiveStream[SessionMessage | Exception],
+        MemoryObjectSendStream[SessionMessage],
+    ]
+]:
+    """Server transport for stdio which uses `stdio_pipe_server` when the
+    file descriptors are dedicated pipes or sockets, and the MCP SDK's
+    thread-based `stdio_server` otherwise."""
+    if can_use_pipe_transports(stdin_fd, stdout_fd):
+        async with stdio_pipe_server(stdin_fd=stdin_fd, stdout_fd=stdout_fd) as streams:
+            yield streams
+        return
+
+    # Use `closefd=False` so that closing the files does not close the process' stdin/stdout.
+    stdin = io.TextIOWrapper(os.fdopen(stdin_fd, "rb", closefd=False), encoding="utf-8")
+    stdout = io.TextIOWrapper(os.fdopen(stdout_fd, "wb", closefd=False), encoding="utf-8")
+    async with mcp_stdio_server(stdin=anyio.wrap_file(stdin), stdout=anyio.wrap_file(stdout)) as (
+        read_stream,
+        write_stream,
+    ):
+        yield read_stream, write_stream
@@ -0,0 +1,146 @@
+# Copyright (C) 2025 Shoal Software LLC. All rights reserved.
+#
+# This is commercial software and cannot be used without prior permission.
+# See the included LICENSE file for further specific terms and conditions.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from collections.abc import Generator
+from pathlib import Path
+
+import pytest
+from mcp import types as mcp_types
+from mcp.shared.message import SessionMessage
+
+from shoalsoft.pants_mcp_plugin import stdio_transport
+from shoalsoft.pants_mcp_plugin.stdio_transport import (
+    can_use_pipe_transports,
+    stdio_pipe_server,
+    stdio_server,
+)
+
+
+@pytest.fixture
+def pipes() -> Generator[tuple[int, int, int, int], None, None]:
+    """Provide the (read, write) ends of a pipe for the server's stdin and
+    of another pipe for its stdout."""
+    stdin_read_fd, stdin_write_fd = os.pipe()
+    stdout_read_fd, stdout_write_fd = os.pipe()
+    try:
+        yield stdin_read_fd, stdin_write_fd, stdout_read_fd, stdout_write_fd
+    finally:
+        for fd in (stdin_read_fd, stdin_write_fd, stdout_read_fd, stdout_write_fd):
+            os.close(fd)
+
+
+def test_pipe_transports_used_for_dedicated_pipes(pipes: tuple[int, int, int, int]) -> None:
+    stdin_read_fd, _, _, stdout_write_fd = pipes
+    assert can_use_pipe_transports(stdin_read_fd, stdout_write_fd)
+
+
+def test_pipe_transports_not_used_for_regular_files(
+    tmp_path: Path, pipes: tuple[int, int, int, int]
+) -> None:
+    stdin_read_fd, _, _, _ = pipes
+    with open(tmp_path / "stdout", "wb") as stdout:
+        assert not can_use_pipe_transports(stdin_read_fd, stdout.fileno())
+
+
+def test_pipe_transports_not_used_when_stderr_is_shared(
+    monkeypatch: pytest.MonkeyPatch, pipes: tuple[int, int, int, int]
+) -> None:
+    stdin_read_fd, _, _, stdout_write_fd = pipes
+    # As if stderr were redirected to stdout.
+    monkeypatch.setattr(stdio_transport, "_STDERR_FD", stdout_write_fd)
+    assert not can_use_pipe_transports(stdin_read_fd, stdout_write_fd)
+
+
+def test_oversized_message_is_reported_and_reading_continues(
+    monkeypatch: pytest.MonkeyPatch, pipes: tuple[int, int, int, int]
+) -> None:
+    stdin_read_fd, stdin_write_fd, _, stdout_write_fd = pipes
+    monkeypatch.setattr(stdio_transport, "MAX_MESSAGE_SIZE", 1024)
+
+    oversized_request = {"jsonrpc": "2.0", "id": 1, "method": "ping", "params": {"x": "x" * 4096}}
+    request = {"jsonrpc": "2.0", "id": 2, "method": "ping"}
+
+    async def run() -> None:
+        async with stdio_pipe_server(stdin_fd=stdin_read_fd, stdout_fd=stdout_write_fd) as (
+            read_stream,
+            _,
+        ):
+            os.write(
+                stdin_write_fd,
+                json.dumps(oversized_request).encode("utf-8")
+                + b"\n"
+                + json.dumps(request).encode("utf-8")
+                + b"\n",
+            )
+
+            # The oversized line is reported as an error. (Depending on how the line arrives, its
+            # tail may also be reported as an invalid message.)
+            errors: list[Exception] = []
+            while True:
+                received = await asyncio.wait_for(read_stream.receive(), timeout=10.0)
+                if isinstance(received, SessionMessage):
+                    break
+                errors.append(received)
+            assert errors and isinstance(errors[0], ValueError)
+            assert received.message.model_dump(exclude_none=True) == request
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("share_stderr", [False, True])
+def test_stdio_server_round_trip(monkeypatch: pytest.MonkeyPatch, share_stderr: bool) -> None:
+    stdin_read_fd, stdin_write_fd = os.pipe()
+    stdout_read_fd, stdout_write_fd = os.pipe()
+    if share_stderr:
+        # Exercise the fallback to the MCP SDK's transport.
+        monkeypatch.setattr(stdio_transport, "_STDERR_FD", stdout_write_fd)
+
+    request = {"jsonrpc": "2.0", "id": 1, "method": "ping"}
+    response = mcp_types.JSONRPCMessage(mcp_types.JSONRPCResponse(jsonrpc="2.0", id=1, result={}))
+
+    async def run() -> None:
+        async with stdio_server(stdin_fd=stdin_read_fd, stdout_fd=stdout_write_fd) as (
+            read_stream,
+            write_stream,
+        ):
+            try:
+                os.write(stdin_write_fd, json.dumps(request).encode("utf-8") + b"\n")
+                received = await asyncio.wait_for(read_stream.receive(), timeout=10.0)
+                assert isinstance(received, SessionMessage)
+                assert received.message.model_dump(exclude_none=True) == request
+
+                await write_stream.send(SessionMessage(response))
+                line = await asyncio.wait_for(
+                    asyncio.to_thread(os.read, stdout_read_fd, 65536), timeout=10.0
+                )
+                assert json.loads(line) == {"jsonrpc": "2.0", "id": 1, "result": {}}
+            finally:
+                # Shut down like `Server.run` and a client which exits do, i.e. close the stream of
+                # outgoing messages and the client's end of stdin.
+                await write_stream.aclose()
+                os.close(stdin_write_fd)
+
+    try:
+        asyncio.run(run())
+
+        # The file descriptors are left in blocking mode once the server exits.
+        assert os.get_blocking(stdin_read_fd)
+        assert os.get_blocking(stdout_write_fd)
+    finally:
+        for fd in (stdin_read_fd, stdout_read_fd, stdout_write_fd):
+            os.close(fd)